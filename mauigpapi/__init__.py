@@ -1,3 +1,38 @@
+from typing import TYPE_CHECKING
+import importlib
+
 from .http import AndroidAPI
-from .mqtt import AndroidMQTT, GraphQLSubscription, SkywalkerSubscription
 from .state import AndroidState
+
+# The MQTT names are resolved lazily, so the connection code (and paho-mqtt) is only
+# imported by code that actually uses it.
+_lazy_imports = {
+    "AndroidMQTT": ".mqtt",
+    "GraphQLSubscription": ".mqtt",
+    "SkywalkerSubscription": ".mqtt",
+}
+
+__all__ = (
+    "AndroidAPI",
+    "AndroidMQTT",
+    "AndroidState",
+    "GraphQLSubscription",
+    "SkywalkerSubscription",
+)
+
+if TYPE_CHECKING:
+    from .mqtt import AndroidMQTT, GraphQLSubscription, SkywalkerSubscription
+
+
+def __getattr__(name: str):
+    try:
+        module_name = _lazy_imports[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list:
+    return sorted({*globals(), *__all__})
@@ -23,6 +23,8 @@ from .base import BaseAndroidAPI
 
 T = TypeVar("T")
 
+PREFILL_USAGES = json.dumps(["account_recovery_omnibox"])
+
 
 class AccountAPI(BaseAndroidAPI):
     async def current_user(self) -> CurrentUserResponse:
@@ -125,7 +127,7 @@ class AccountAPI(BaseAndroidAPI):
     async def get_prefill_candidates(self):
         req = {
             "android_device_id": self.state.device.id,
-            "usages": json.dumps(["account_recovery_omnibox"]),
+            "usages": PREFILL_USAGES,
             "device_id": self.state.device.uuid,
         }
         # TODO parse response content
@@ -138,7 +140,7 @@ class AccountAPI(BaseAndroidAPI):
             "_uid": self.state.session.ds_user_id,
             "device_id": self.state.device.uuid,
             "_uuid": self.state.device.uuid,
-            "google_tokens": json.dumps([]),
+            "google_tokens": "[]",
         }
         return await self.std_http_post(
             "/api/v1/accounts/process_contact_point_signals/", data=req
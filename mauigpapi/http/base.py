@@ -21,7 +21,7 @@ import json
 import logging
 import time
 
-from aiohttp import ClientResponse, ClientSession, CookieJar
+from aiohttp import ClientResponse, ClientSession, CookieJar, TCPConnector
 from yarl import URL
 
 from mautrix.types import JSON, Serializable
@@ -61,6 +61,33 @@ try:
 except ImportError:
     ProxyConnector = None
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_dumps_stdlib(data: Any) -> str:
+    encoded = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    try:
+        encoded.encode("utf-8")
+    except UnicodeEncodeError:
+        # Lone surrogates can't be sent as UTF-8, so escape all non-ASCII characters instead
+        encoded = json.dumps(data, separators=(",", ":"))
+    return encoded
+
+
+def json_dumps(data: Any) -> str:
+    # Compact JSON with raw UTF-8, so the output is the same whether or not orjson is installed
+    if orjson:
+        try:
+            return orjson.dumps(data).decode("utf-8")
+        except TypeError:
+            # orjson rejects lone surrogates, non-str dict keys and integers over 64 bits
+            pass
+    return _json_dumps_stdlib(data)
+
+
 T = TypeVar("T")
 
 
@@ -108,21 +135,23 @@ class BaseAndroidAPI:
         if isinstance(req, Serializable):
             req = req.serialize()
         if isinstance(req, dict):
-            req = json.dumps(remove_nulls(req) if filter_nulls else req)
+            req = json_dumps(remove_nulls(req) if filter_nulls else req)
         return {"signed_body": f"SIGNATURE.{req}"}
 
     @property
     def _rupload_headers(self) -> dict[str, str]:
+        state = self.state
+        session = state.session
         headers = {
-            "user-agent": self.state.user_agent,
-            "accept-language": self.state.device.language.replace("_", "-"),
-            "authorization": self.state.session.authorization,
-            "x-mid": self.state.cookies.get_value("mid"),
-            "ig-u-shbid": self.state.session.shbid,
-            "ig-u-shbts": self.state.session.shbts,
-            "ig-u-ds-user-id": self.state.session.ds_user_id,
-            "ig-u-rur": self.state.session.rur,
-            "ig-intended-user-id": self.state.session.ds_user_id or "0",
+            "user-agent": state.user_agent,
+            "accept-language": state.device.language.replace("_", "-"),
+            "authorization": session.authorization,
+            "x-mid": state.cookies.get_value("mid"),
+            "ig-u-shbid": session.shbid,
+            "ig-u-shbts": session.shbts,
+            "ig-u-ds-user-id": session.ds_user_id,
+            "ig-u-rur": session.rur,
+            "ig-intended-user-id": session.ds_user_id or "0",
             "x-fb-http-engine": "Liger",
             "x-fb-client-ip": "True",
             "x-fb-server-cluster": "True",
@@ -132,36 +161,42 @@ class BaseAndroidAPI:
 
     @property
     def _headers(self) -> dict[str, str]:
+        state = self.state
+        device = state.device
+        session = state.session
         headers = {
-            "x-ads-opt-out": str(int(self.state.session.ads_opt_out)),
-            "x-device-id": self.state.device.uuid,
-            "x-ig-app-locale": self.state.device.language,
-            "x-ig-device-locale": self.state.device.language,
-            "x-ig-mapped-locale": self.state.device.language,
-            "x-pigeon-session-id": f"UFS-{self.state.pigeon_session_id}-0",
+            "x-ads-opt-out": str(int(session.ads_opt_out)),
+            "x-device-id": device.uuid,
+            "x-ig-app-locale": device.language,
+            "x-ig-device-locale": device.language,
+            "x-ig-mapped-locale": device.language,
+            "x-pigeon-session-id": f"UFS-{state.pigeon_session_id}-0",
             "x-pigeon-rawclienttime": str(round(time.time(), 3)),
             "x-ig-bandwidth-speed-kbps": "-1.000",
             "x-ig-bandwidth-totalbytes-b": "0",
             "x-ig-bandwidth-totaltime-ms": "0",
-            "x-ig-app-startup-country": self.state.device.language.split("_")[1],
-            "x-bloks-version-id": self.state.application.BLOKS_VERSION_ID,
-            "x-ig-www-claim": self.state.session.ig_www_claim or "0",
-            "x-bloks-is-layout-rtl": str(self.state.device.is_layout_rtl).lower(),
-            "x-ig-timezone-offset": self.state.device.timezone_offset,
-            "x-ig-device-id": self.state.device.uuid,
-            "x-ig-family-device-id": self.state.device.fdid,
-            "x-ig-android-id": self.state.device.id,
-            "x-ig-connection-type": self.state.device.connection_type,
-            "x-fb-connection-type": self.state.device.connection_type,
-            "x-ig-capabilities": self.state.application.CAPABILITIES,
-            "x-ig-app-id": self.state.application.FACEBOOK_ANALYTICS_APPLICATION_ID,
+            "x-ig-app-startup-country": device.language.split("_")[1],
+            "x-bloks-version-id": state.application.BLOKS_VERSION_ID,
+            "x-ig-www-claim": session.ig_www_claim or "0",
+            "x-bloks-is-layout-rtl": str(device.is_layout_rtl).lower(),
+            "x-ig-timezone-offset": device.timezone_offset,
+            "x-ig-device-id": device.uuid,
+            "x-ig-family-device-id": device.fdid,
+            "x-ig-android-id": device.id,
+            "x-ig-connection-type": device.connection_type,
+            "x-fb-connection-type": device.connection_type,
+            "x-ig-capabilities": state.application.CAPABILITIES,
+            "x-ig-app-id": state.application.FACEBOOK_ANALYTICS_APPLICATION_ID,
             "ig-client-endpoint": "unknown",
             "x-fb-rmd": "cached=0;state=NO_MATCH",
             "x-tigon-is-retry": "False",
-            "ig-u-ig-direct-region-hint": self.state.session.region_hint,
+            "ig-u-ig-direct-region-hint": session.region_hint,
+        }
+        # _rupload_headers is already filtered, so only filter the headers defined here
+        return {
+            **{k: v for k, v in headers.items() if v is not None},
             **self._rupload_headers,
         }
-        return {k: v for k, v in headers.items() if v is not None}
 
     def setup_http(self, cookie_jar: CookieJar) -> None:
         connector = None
@@ -171,6 +206,11 @@ class BaseAndroidAPI:
                 connector = ProxyConnector.from_url(http_proxy)
             else:
                 self.log.warning("http_proxy is set, but aiohttp-socks is not installed")
+        if connector is None:
+            # Keep DNS results and idle connections around for longer than the defaults
+            # (10 and 15 seconds), so sporadic requests to i.instagram.com and
+            # rupload.facebook.com can reuse existing connections instead of reconnecting.
+            connector = TCPConnector(ttl_dns_cache=300, keepalive_timeout=60)
 
         self.http = ClientSession(connector=connector, cookie_jar=cookie_jar)
         return None
@@ -16,7 +16,7 @@
 from __future__ import annotations
 
 import base64
-import io
+import binascii
 import json
 import struct
 import time
@@ -29,6 +29,8 @@ from Crypto.Random import get_random_bytes
 from ..types import FacebookLoginResponse, LoginErrorResponse, LoginResponse, LogoutResponse
 from .base import BaseAndroidAPI
 
+COUNTRY_CODES = json.dumps([{"country_code": "1", "source": "default"}])
+
 
 class LoginAPI(BaseAndroidAPI):
     async def get_mobile_config(self) -> None:
@@ -56,16 +58,17 @@ class LoginAPI(BaseAndroidAPI):
             encrypted_password = self._encrypt_password(password)
         elif not encrypted_password:
             raise ValueError("One of password or encrypted_password is required")
+        device = self.state.device
         req = {
             "username": username,
             "enc_password": encrypted_password,
-            "guid": self.state.device.uuid,
-            "phone_id": self.state.device.phone_id,
-            "device_id": self.state.device.id,
-            "adid": self.state.device.adid,
+            "guid": device.uuid,
+            "phone_id": device.phone_id,
+            "device_id": device.id,
+            "adid": device.adid,
             "google_tokens": "[]",
             "login_attempt_count": "0",  # TODO maybe cache this somewhere?
-            "country_codes": json.dumps([{"country_code": "1", "source": "default"}]),
+            "country_codes": COUNTRY_CODES,
             "jazoest": self._jazoest,
         }
         return await self.std_http_post(
@@ -73,12 +76,13 @@ class LoginAPI(BaseAndroidAPI):
         )
 
     async def one_tap_app_login(self, user_id: str, nonce: str) -> LoginResponse:
+        device = self.state.device
         req = {
-            "phone_id": self.state.device.phone_id,
+            "phone_id": device.phone_id,
             "user_id": user_id,
-            "adid": self.state.device.adid,
-            "guid": self.state.device.uuid,
-            "device_id": self.state.device.id,
+            "adid": device.adid,
+            "guid": device.uuid,
+            "device_id": device.id,
             "login_nonce": nonce,
         }
         return await self.std_http_post(
@@ -108,13 +112,14 @@ class LoginAPI(BaseAndroidAPI):
         trust_device: bool = True,
         is_totp: bool = True,
     ) -> LoginResponse:
+        device = self.state.device
         req = {
             "verification_code": code,
             "two_factor_identifier": identifier,
             "username": username,
             "trust_this_device": "1" if trust_device else "0",
-            "guid": self.state.device.uuid,
-            "device_id": self.state.device.id,
+            "guid": device.uuid,
+            "device_id": device.id,
             # TOTP = 3, Backup code = 2, SMS = 1
             "verification_method": "3" if is_totp else "1",
         }
@@ -126,15 +131,16 @@ class LoginAPI(BaseAndroidAPI):
     #     pass
 
     async def facebook_signup(self, fb_access_token: str) -> FacebookLoginResponse:
+        device = self.state.device
         req = {
             "jazoest": self._jazoest,
             "dryrun": "true",
             "fb_req_flag": "false",
-            "phone_id": self.state.device.phone_id,
+            "phone_id": device.phone_id,
             "force_signup_with_fb_after_cp_claiming": "false",
-            "adid": self.state.device.adid,
-            "guid": self.state.device.uuid,
-            "device_id": self.state.device.id,
+            "adid": device.adid,
+            "guid": device.uuid,
+            "device_id": device.id,
             # "waterfall_id": uuid4(),
             "fb_access_token": fb_access_token,
         }
@@ -143,11 +149,12 @@ class LoginAPI(BaseAndroidAPI):
         )
 
     async def logout(self, one_tap_app_login: bool | None = None) -> LogoutResponse:
+        device = self.state.device
         req = {
-            "guid": self.state.device.uuid,
-            "phone_id": self.state.device.phone_id,
-            "device_id": self.state.device.id,
-            "_uuid": self.state.device.uuid,
+            "guid": device.uuid,
+            "phone_id": device.phone_id,
+            "device_id": device.id,
+            "_uuid": device.uuid,
             "one_tap_app_login": one_tap_app_login,
         }
         return await self.std_http_post(
@@ -193,18 +200,22 @@ class LoginAPI(BaseAndroidAPI):
         # Encrypt the password and get the AES MAC auth tag
         encrypted_passwd, auth_tag = cipher_aes.encrypt_and_digest(password.encode("utf-8"))
 
-        buf = io.BytesIO()
-        # 1 is presumably the version
-        buf.write(bytes([1, int(self.state.session.password_encryption_key_id)]))
-        buf.write(iv)
-        # Length of the encrypted AES key as a little-endian 16-bit int
-        buf.write(struct.pack("<h", len(encrypted_rand_key)))
-        buf.write(encrypted_rand_key)
-        buf.write(auth_tag)
-        buf.write(encrypted_passwd)
-        encoded = base64.b64encode(buf.getvalue()).decode("utf-8")
+        payload = b"".join(
+            (
+                # 1 is presumably the version
+                bytes([1, int(self.state.session.password_encryption_key_id)]),
+                iv,
+                # Length of the encrypted AES key as a little-endian 16-bit int
+                struct.pack("<h", len(encrypted_rand_key)),
+                encrypted_rand_key,
+                auth_tag,
+                encrypted_passwd,
+            )
+        )
+        encoded = binascii.b2a_base64(payload, newline=False).decode("ascii")
         return f"#PWD_INSTAGRAM:4:{current_time}:{encoded}"
 
     @property
     def _jazoest(self) -> str:
-        return f"2{sum(ord(i) for i in self.state.device.phone_id)}"
+        # phone_id is always an ASCII UUID, so summing the bytes equals summing the codepoints
+        return f"2{sum(self.state.device.phone_id.encode('ascii'))}"
@@ -15,9 +15,8 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-from typing import AsyncIterable, Callable, Type
+from typing import AsyncGenerator, Callable, Type
 import asyncio
-import json
 
 from mauigpapi.errors.response import IGRateLimitError
 
@@ -30,7 +29,26 @@ from ..types import (
     ThreadAction,
     ThreadItemType,
 )
-from .base import BaseAndroidAPI, T
+from .base import BaseAndroidAPI, T, json_dumps
+
+INBOX_HEADERS = {
+    # MainFeedFragment:feed_timeline for limit=0 cold start fetch
+    "ig-client-endpoint": "DirectInboxFragment:direct_inbox",
+}
+THREAD_HEADERS = {
+    "ig-client-endpoint": "DirectThreadFragment:direct_thread",
+    "x-ig-nav-chain": (
+        "MainFeedFragment:feed_timeline:1:cold_start::,"
+        "DirectInboxFragment:direct_inbox:4:on_launch_direct_inbox::"
+    ),
+}
+
+# Static fields of the _broadcast form, the per-message fields are added on top of these
+BROADCAST_FORM_TEMPLATE = {
+    "action": ThreadAction.SEND_ITEM.value,
+    "send_attribution": "direct_thread",
+    "is_shh_mode": "0",
+}
 
 
 class ThreadAPI(BaseAndroidAPI):
@@ -62,12 +80,11 @@ class ThreadAPI(BaseAndroidAPI):
                 inbox_type = "spam_inbox"
         elif not cursor:
             query["fetch_reason"] = "initial_snapshot"  # can also be manual_refresh
-        headers = {
-            # MainFeedFragment:feed_timeline for limit=0 cold start fetch
-            "ig-client-endpoint": "DirectInboxFragment:direct_inbox",
-        }
         return await self.std_http_get(
-            f"/api/v1/direct_v2/{inbox_type}/", query=query, response_type=DMInboxResponse
+            f"/api/v1/direct_v2/{inbox_type}/",
+            query=query,
+            headers=INBOX_HEADERS,
+            response_type=DMInboxResponse,
         )
 
     async def iter_inbox(
@@ -76,45 +93,72 @@ class ThreadAPI(BaseAndroidAPI):
         start_at: DMInboxResponse | None = None,
         local_limit: int | None = None,
         rate_limit_exceeded_backoff: float = 60.0,
-    ) -> AsyncIterable[Thread]:
+    ) -> AsyncGenerator[Thread, None]:
         thread_counter = 0
-        if start_at:
-            cursor = start_at.inbox.oldest_cursor
-            seq_id = start_at.seq_id
-            has_more = start_at.inbox.has_older
-            for thread in start_at.inbox.threads:
-                yield thread
-                thread_counter += 1
-                if local_limit and thread_counter >= local_limit:
-                    return
-            update_seq_id_and_cursor(seq_id, cursor)
-        else:
-            cursor = None
-            seq_id = None
-            has_more = True
-        while has_more:
-            try:
-                resp = await self.get_inbox(cursor=cursor, seq_id=seq_id)
-            except IGRateLimitError:
-                self.log.warning(
-                    "Fetching more threads failed due to rate limit. Waiting for "
-                    f"{rate_limit_exceeded_backoff} seconds before resuming."
+        next_page: asyncio.Task | None = None
+        try:
+            if start_at:
+                cursor = start_at.inbox.oldest_cursor
+                seq_id = start_at.seq_id
+                has_more = start_at.inbox.has_older
+                threads = start_at.inbox.threads
+                prefetch = has_more and not (local_limit and len(threads) >= local_limit)
+                for i, thread in enumerate(threads, 1):
+                    # Only start fetching the next page once the consumer has asked for the last
+                    # thread of this one, so that stopping early rarely wastes a request.
+                    if prefetch and i == len(threads):
+                        next_page = asyncio.create_task(
+                            self.get_inbox(cursor=cursor, seq_id=seq_id)
+                        )
+                    yield thread
+                    thread_counter += 1
+                    if local_limit and thread_counter >= local_limit:
+                        return
+                update_seq_id_and_cursor(seq_id, cursor)
+            else:
+                cursor = None
+                seq_id = None
+                has_more = True
+            while has_more:
+                if next_page is None:
+                    next_page = asyncio.create_task(self.get_inbox(cursor=cursor, seq_id=seq_id))
+                try:
+                    resp = await next_page
+                except IGRateLimitError:
+                    next_page = None
+                    self.log.warning(
+                        "Fetching more threads failed due to rate limit. Waiting for "
+                        f"{rate_limit_exceeded_backoff} seconds before resuming."
+                    )
+                    await asyncio.sleep(rate_limit_exceeded_backoff)
+                    continue
+                except Exception:
+                    next_page = None
+                    self.log.exception("Failed to fetch more threads")
+                    raise
+
+                seq_id = resp.seq_id
+                cursor = resp.inbox.oldest_cursor
+                has_more = resp.inbox.has_older
+                threads = resp.inbox.threads
+                next_page = None
+                prefetch = has_more and not (
+                    local_limit and thread_counter + len(threads) >= local_limit
                 )
-                await asyncio.sleep(rate_limit_exceeded_backoff)
-                continue
-            except Exception:
-                self.log.exception("Failed to fetch more threads")
-                raise
-
-            seq_id = resp.seq_id
-            cursor = resp.inbox.oldest_cursor
-            has_more = resp.inbox.has_older
-            for thread in resp.inbox.threads:
-                yield thread
-                thread_counter += 1
-                if local_limit and thread_counter >= local_limit:
-                    return
-            update_seq_id_and_cursor(seq_id, cursor)
+                for i, thread in enumerate(threads, 1):
+                    if prefetch and i == len(threads):
+                        next_page = asyncio.create_task(
+                            self.get_inbox(cursor=cursor, seq_id=seq_id)
+                        )
+                    yield thread
+                    thread_counter += 1
+                    if local_limit and thread_counter >= local_limit:
+                        return
+                update_seq_id_and_cursor(seq_id, cursor)
+        finally:
+            if next_page is not None:
+                # This also marks the exception of an already failed prefetch as retrieved
+                next_page.cancel()
 
     async def get_thread(
         self,
@@ -131,12 +175,11 @@ class ThreadAPI(BaseAndroidAPI):
             "seq_id": seq_id,
             "limit": limit,
         }
-        headers = {
-            "ig-client-endpoint": "DirectThreadFragment:direct_thread",
-            "x-ig-nav-chain": "MainFeedFragment:feed_timeline:1:cold_start::,DirectInboxFragment:direct_inbox:4:on_launch_direct_inbox::",
-        }
         return await self.std_http_get(
-            f"/api/v1/direct_v2/threads/{thread_id}/", query=query, response_type=DMThreadResponse
+            f"/api/v1/direct_v2/threads/{thread_id}/",
+            query=query,
+            headers=THREAD_HEADERS,
+            response_type=DMThreadResponse,
         )
 
     async def create_group_thread(self, recipient_users: list[int | str]) -> Thread:
@@ -146,9 +189,7 @@ class ThreadAPI(BaseAndroidAPI):
                 "_csrftoken": self.state.cookies.csrf_token,
                 "_uuid": self.state.device.uuid,
                 "_uid": self.state.session.ds_user_id,
-                "recipient_users": json.dumps(
-                    [str(user) for user in recipient_users], separators=(",", ":")
-                ),
+                "recipient_users": json_dumps([str(user) for user in recipient_users]),
             },
             response_type=Thread,
         )
@@ -167,9 +208,7 @@ class ThreadAPI(BaseAndroidAPI):
         await self.std_http_post(
             "/api/v1/direct_v2/threads/approve_multiple/",
             data={
-                "thread_ids": json.dumps(
-                    [str(thread) for thread in thread_ids], separators=(",", ":")
-                ),
+                "thread_ids": json_dumps([str(thread) for thread in thread_ids]),
                 "folder": "",
             },
         )
@@ -189,17 +228,16 @@ class ThreadAPI(BaseAndroidAPI):
         client_context: str | None = None,
         **kwargs,
     ) -> T:
-        client_context = client_context or self.state.gen_client_context()
+        state = self.state
+        client_context = client_context or state.gen_client_context()
         form = {
-            "action": ThreadAction.SEND_ITEM.value,
-            "send_attribution": "direct_thread",
+            **BROADCAST_FORM_TEMPLATE,
             "thread_ids": f"[{thread_id}]",
-            "is_shh_mode": "0",
             "client_context": client_context,
-            "_csrftoken": self.state.cookies.csrf_token,
-            "device_id": self.state.device.id,
+            "_csrftoken": state.cookies.csrf_token,
+            "device_id": state.device.id,
             "mutation_token": client_context,
-            "_uuid": self.state.device.uuid,
+            "_uuid": state.device.uuid,
             **kwargs,
             "offline_threading_id": client_context,
         }
@@ -23,6 +23,22 @@ from yarl import URL
 from ..types import FacebookUploadResponse
 from .base import BaseAndroidAPI
 
+RUPLOAD_STATIC_HEADERS = {
+    "offset": "0",
+    "Content-Type": "application/octet-stream",
+    "priority": "u=6, i",
+}
+
+_last_upload_id = 0
+
+
+def _next_upload_id() -> str:
+    # Upload IDs are millisecond timestamps, make sure uploads started within the same
+    # millisecond still get unique IDs.
+    global _last_upload_id
+    _last_upload_id = max(time.time_ns() // 1_000_000, _last_upload_id + 1)
+    return str(_last_upload_id)
+
 
 class UploadAPI(BaseAndroidAPI):
     rupload_fb = URL("https://rupload.facebook.com")
@@ -33,9 +49,7 @@ class UploadAPI(BaseAndroidAPI):
             "x-entity-length": str(length),
             "x-entity-name": name,
             "x-entity-type": mime,
-            "offset": "0",
-            "Content-Type": "application/octet-stream",
-            "priority": "u=6, i",
+            **RUPLOAD_STATIC_HEADERS,
         }
 
     async def upload(
@@ -44,8 +58,8 @@ class UploadAPI(BaseAndroidAPI):
         mimetype: str,
         upload_id: str | None = None,
     ) -> FacebookUploadResponse:
-        upload_id = upload_id or str(int(time.time() * 1000))
-        name = f"{upload_id}_0_{random.randint(1000000000, 9999999999)}"
+        upload_id = upload_id or _next_upload_id()
+        name = f"{upload_id}_0_{random.randrange(1000000000, 10000000000)}"
         headers = self._make_rupload_headers(len(data), name, mimetype)
         if mimetype.startswith("image/"):
             path_type = "messenger_gif" if mimetype == "image/gif" else "messenger_image"
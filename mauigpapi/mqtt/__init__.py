@@ -1,3 +1,35 @@
-from .conn import AndroidMQTT
-from .events import Connect, Disconnect, NewSequenceID, ProxyUpdate
-from .subscription import GraphQLSubscription, SkywalkerSubscription
+from typing import TYPE_CHECKING
+import importlib
+
+# The connection module pulls in paho-mqtt and the thrift code, so the public names are only
+# imported from their submodules when they're first accessed.
+_lazy_imports = {
+    "AndroidMQTT": ".conn",
+    "Connect": ".events",
+    "Disconnect": ".events",
+    "NewSequenceID": ".events",
+    "ProxyUpdate": ".events",
+    "GraphQLSubscription": ".subscription",
+    "SkywalkerSubscription": ".subscription",
+}
+
+__all__ = tuple(_lazy_imports)
+
+if TYPE_CHECKING:
+    from .conn import AndroidMQTT
+    from .events import Connect, Disconnect, NewSequenceID, ProxyUpdate
+    from .subscription import GraphQLSubscription, SkywalkerSubscription
+
+
+def __getattr__(name: str):
+    try:
+        module_name = _lazy_imports[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list:
+    return sorted({*globals(), *__all__})
@@ -16,8 +16,7 @@
 from __future__ import annotations
 
 from typing import Any, Awaitable, Callable, Iterable, Type, TypeVar
-from collections import defaultdict
-from socket import error as SocketError, socket
+from socket import IPPROTO_TCP, TCP_NODELAY, error as SocketError, socket
 import asyncio
 import json
 import logging
@@ -39,6 +38,7 @@ from ..errors import (
     MQTTNotLoggedIn,
     MQTTReconnectionError,
 )
+from ..http.base import json_dumps
 from ..state import AndroidState
 from ..types import (
     AppPresenceEventPayload,
@@ -64,7 +64,7 @@ from ..types import (
 )
 from .events import Connect, Disconnect, NewSequenceID, ProxyUpdate
 from .otclient import MQTToTClient
-from .subscription import GraphQLQueryID, RealtimeTopic, everclear_subscriptions
+from .subscription import GRAPHQL_QUERY_IDS, GraphQLQueryID, RealtimeTopic, everclear_subscriptions
 from .thrift import ForegroundStateConfig, IncomingMessage, RealtimeClientInfo, RealtimeConfig
 
 try:
@@ -72,6 +72,45 @@ try:
 except ImportError:
     socks = None
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError is a subclass of json.JSONDecodeError, so error handling is the same.
+# orjson turns integers over 64 bits into floats, but Instagram sends all such IDs as strings.
+json_loads = orjson.loads if orjson else json.loads
+
+try:
+    from isal import isal_zlib
+except ImportError:
+    isal_zlib = None
+
+# isal only supports compression levels up to 3, so it's only used for decompressing.
+_inflate = isal_zlib or zlib
+# Real payloads are at most a few hundred kilobytes, anything bigger is garbage or a zip bomb
+MAX_DECOMPRESSED_SIZE = 32 * 1024 * 1024
+
+
+def zlib_compress(data: bytes) -> bytes:
+    # Most payloads are a few hundred bytes, and setting up the default 32 KiB window takes
+    # longer than compressing them. A window sized to the payload compresses just as well,
+    # and any zlib inflater can decompress it.
+    # zlib.compress() only accepts wbits on Python 3.11+, so use a compressobj.
+    compressor = zlib.compressobj(9, zlib.DEFLATED, min(max(len(data).bit_length(), 9), 15))
+    return compressor.compress(data) + compressor.flush()
+
+
+def zlib_decompress(data: bytes) -> bytes:
+    decompressor = _inflate.decompressobj()
+    out = decompressor.decompress(data, MAX_DECOMPRESSED_SIZE)
+    if not decompressor.eof:
+        raise ValueError(
+            f"Payload is truncated or decompresses to more than {MAX_DECOMPRESSED_SIZE} bytes"
+        )
+    return out
+
+
 T = TypeVar("T")
 
 ACTIVITY_INDICATOR_REGEX = re.compile(
@@ -80,6 +119,37 @@ ACTIVITY_INDICATOR_REGEX = re.compile(
 
 INBOX_THREAD_REGEX = re.compile(r"/direct_v2/inbox/threads/([\w_]+)")
 
+REALTIME_SUB_PARSERS: dict[GraphQLQueryID, Callable[[dict], Any]] = {
+    GraphQLQueryID.APP_PRESENCE: (
+        lambda raw: AppPresenceEventPayload.deserialize(raw).presence_event
+    ),
+    GraphQLQueryID.ZERO_PROVISION: (
+        lambda raw: RealtimeZeroProvisionPayload.deserialize(raw).zero_product_provisioning_event
+    ),
+    GraphQLQueryID.CLIENT_CONFIG_UPDATE: (
+        lambda raw: ClientConfigUpdatePayload.deserialize(raw).client_config_update_event
+    ),
+    GraphQLQueryID.LIVE_REALTIME_COMMENTS: (
+        lambda raw: LiveVideoCommentPayload.deserialize(raw).live_video_comment_event
+    ),
+}
+
+SUBSCRIBE_TOPICS = (
+    RealtimeTopic.PUBSUB,  # 88
+    RealtimeTopic.SUB_IRIS_RESPONSE,  # 135
+    RealtimeTopic.RS_REQ,  # 244
+    RealtimeTopic.REALTIME_SUB,  # 149
+    RealtimeTopic.REGION_HINT,  # 150
+    RealtimeTopic.RS_RESP,  # 245
+    RealtimeTopic.T_RTC_LOG,  # 274
+    RealtimeTopic.SEND_MESSAGE_RESPONSE,  # 133
+    RealtimeTopic.MESSAGE_SYNC,  # 146
+    RealtimeTopic.LIGHTSPEED_RESPONSE,  # 179
+    RealtimeTopic.UNKNOWN_PP,  # 34
+)
+SUBSCRIBE_TOPIC_IDS = [int(topic.encoded) for topic in SUBSCRIBE_TOPICS]
+EVERCLEAR_SUBSCRIPTIONS_JSON = json.dumps(everclear_subscriptions)
+
 REQUEST_TIMEOUT = 60 * 3
 REQUEST_KEEPALIVE = 5
 
@@ -96,13 +166,13 @@ class AndroidMQTT:
     _publish_waiters: dict[int, asyncio.Future]
     _response_waiters: dict[RealtimeTopic, asyncio.Future]
     _response_waiter_locks: dict[RealtimeTopic, asyncio.Lock]
-    _message_response_waiter_lock: asyncio.Lock
-    _message_response_waiter_id: str | None
-    _message_response_waiter: asyncio.Future | None
+    _message_response_waiters: dict[str, asyncio.Future]
     _disconnect_error: Exception | None
     _event_handlers: dict[Type[T], list[Callable[[T], Awaitable[None]]]]
     _outgoing_events: asyncio.Queue
     _event_dispatcher_task: asyncio.Task | None
+    _topic_handlers: dict[RealtimeTopic, Callable[[pmc.MQTTMessage], None]]
+    _misc_loop_wakeup: asyncio.Event
 
     # region Initialization
 
@@ -119,14 +189,13 @@ class AndroidMQTT:
         self._iris_snapshot_at_ms = None
         self._publish_waiters = {}
         self._response_waiters = {}
-        self._message_response_waiter_lock = asyncio.Lock()
-        self._message_response_waiter_id = None
-        self._message_response_waiter = None
+        self._message_response_waiters = {}
         self._disconnect_error = None
-        self._response_waiter_locks = defaultdict(lambda: asyncio.Lock())
-        self._event_handlers = defaultdict(lambda: [])
+        self._response_waiter_locks = {topic: asyncio.Lock() for topic in RealtimeTopic}
+        self._event_handlers = {}
         self._event_dispatcher_task = None
         self._outgoing_events = asyncio.Queue()
+        self._misc_loop_wakeup = asyncio.Event()
         self.log = log or logging.getLogger("mauigpapi.mqtt")
         self._loop = asyncio.get_running_loop()
         self.state = state
@@ -146,6 +215,13 @@ class AndroidMQTT:
         # mqtt.reconnect_delay_set(min_delay=1, max_delay=120)
         self._default_keepalive = mqtt_keepalive
         self._client.connect_async("edge-mqtt.facebook.com", 443, keepalive=mqtt_keepalive)
+        self._topic_handlers = {
+            RealtimeTopic.MESSAGE_SYNC: self._on_message_sync,
+            RealtimeTopic.PUBSUB: self._on_pubsub,
+            RealtimeTopic.REALTIME_SUB: self._on_realtime_sub,
+            RealtimeTopic.SEND_MESSAGE_RESPONSE: self._handle_send_response,
+            RealtimeTopic.UNKNOWN_PP: self._on_unknown_pp,
+        }
         self._client.on_message = self._on_message_handler
         self._client.on_publish = self._on_publish_handler
         self._client.on_connect = self._on_connect_handler
@@ -184,20 +260,6 @@ class AndroidMQTT:
         self._publish_waiters = {}
 
     def _form_client_id(self) -> bytes:
-        subscribe_topics = [
-            RealtimeTopic.PUBSUB,  # 88
-            RealtimeTopic.SUB_IRIS_RESPONSE,  # 135
-            RealtimeTopic.RS_REQ,  # 244
-            RealtimeTopic.REALTIME_SUB,  # 149
-            RealtimeTopic.REGION_HINT,  # 150
-            RealtimeTopic.RS_RESP,  # 245
-            RealtimeTopic.T_RTC_LOG,  # 274
-            RealtimeTopic.SEND_MESSAGE_RESPONSE,  # 133
-            RealtimeTopic.MESSAGE_SYNC,  # 146
-            RealtimeTopic.LIGHTSPEED_RESPONSE,  # 179
-            RealtimeTopic.UNKNOWN_PP,  # 34
-        ]
-        subscribe_topic_ids = [int(topic.encoded) for topic in subscribe_topics]
         password = f"authorization={self.state.session.authorization}"
         cfg = RealtimeConfig(
             client_identifier=self.state.device.phone_id[:20],
@@ -213,8 +275,8 @@ class AndroidMQTT:
                 is_initially_foreground=False,
                 network_type=1,
                 network_subtype=-1,
-                client_mqtt_session_id=int(time.time() * 1000) & 0xFFFFFFFF,
-                subscribe_topics=subscribe_topic_ids,
+                client_mqtt_session_id=(time.time_ns() // 1_000_000) & 0xFFFFFFFF,
+                subscribe_topics=SUBSCRIBE_TOPIC_IDS,
                 client_type="cookie_auth",
                 app_id=567067343352427,
                 # region_preference=self.state.session.region_hint or "LLA",
@@ -225,7 +287,7 @@ class AndroidMQTT:
             app_specific_info={
                 "capabilities": self.state.application.CAPABILITIES,
                 "app_version": self.state.application.APP_VERSION,
-                "everclear_subscriptions": json.dumps(everclear_subscriptions),
+                "everclear_subscriptions": EVERCLEAR_SUBSCRIPTIONS_JSON,
                 "User-Agent": self.state.user_agent,
                 "Accept-Language": self.state.device.language.replace("_", "-"),
                 "platform": "android",
@@ -234,12 +296,24 @@ class AndroidMQTT:
                 "auth_cache_enabled": "1",
             },
         )
-        return zlib.compress(cfg.to_thrift(), level=9)
+        return zlib_compress(cfg.to_thrift())
 
     # endregion
 
     def _on_socket_open(self, client: MQTToTClient, _: Any, sock: socket) -> None:
-        self._loop.add_reader(sock, client.loop_read)
+        # Packets are small and latency-sensitive (e.g. a PUBACK right after a publish),
+        # so don't let Nagle's algorithm hold them back waiting for ACKs.
+        sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        self._loop.add_reader(sock, self._on_socket_readable, client, sock)
+
+    @staticmethod
+    def _on_socket_readable(client: MQTToTClient, sock: socket) -> None:
+        client.loop_read()
+        # paho only reads one packet per call, and data that the TLS layer has already
+        # decrypted won't make the socket readable again, so drain it here.
+        pending = getattr(sock, "pending", None)
+        while pending and client.socket() is sock and pending() > 0:
+            client.loop_read()
 
     def _on_socket_close(self, client: MQTToTClient, _: Any, sock: socket) -> None:
         self._loop.remove_reader(sock)
@@ -267,6 +341,7 @@ class AndroidMQTT:
         err_str = "Generic error." if rc == pmc.MQTT_ERR_NOMEM else pmc.error_string(rc)
         self.log.debug("MQTT disconnection code %d: %s", rc, err_str)
         self._clear_publish_waiters()
+        self._misc_loop_wakeup.set()
 
     async def _post_connect(self) -> None:
         await self._dispatch(Connect())
@@ -297,9 +372,9 @@ class AndroidMQTT:
         try:
             waiter = self._publish_waiters.pop(mid)
         except KeyError:
-            self.log.trace(f"Got publish confirmation for {mid}, but no waiters")
+            self.log.trace("Got publish confirmation for %s, but no waiters", mid)
             return
-        self.log.trace(f"Got publish confirmation for {mid}")
+        self.log.trace("Got publish confirmation for %s", mid)
         if not waiter.done():
             waiter.set_result(None)
         self.maybe_reset_keepalive()
@@ -310,10 +385,10 @@ class AndroidMQTT:
         try:
             blank, direct_v2, threads, thread_id, *rest = path.split("/")
         except (ValueError, IndexError) as e:
-            self.log.debug(f"Got {e!r} while parsing path {path}")
+            self.log.debug("Got %r while parsing path %s", e, path)
             raise
         if (blank, direct_v2, threads) != ("", "direct_v2", "threads"):
-            self.log.debug(f"Got unexpected first parts in direct thread path {path}")
+            self.log.debug("Got unexpected first parts in direct thread path %s", path)
             raise ValueError("unexpected first three parts in _parse_direct_thread_path")
         additional = {"thread_id": thread_id}
         if rest:
@@ -338,13 +413,11 @@ class AndroidMQTT:
 
     def _on_messager_sync_item(self, part: IrisPayloadData, parsed_item: IrisPayload) -> bool:
         if part.path.startswith("/direct_v2/threads/"):
-            raw_message = {
-                "path": part.path,
-                "op": part.op,
-                **self._parse_direct_thread_path(part.path),
-            }
+            raw_message = self._parse_direct_thread_path(part.path)
+            raw_message["path"] = part.path
+            raw_message["op"] = part.op
             try:
-                json_value = json.loads(part.value)
+                json_value = json_loads(part.value)
                 if "reaction_type" in raw_message:
                     self.log.trace("Treating %s as new reaction data", json_value)
                     raw_message["new_reaction"] = json_value
@@ -354,139 +427,108 @@ class AndroidMQTT:
                     if part.op == Operation.REMOVE:
                         json_value["emoji"] = None
                         json_value["timestamp"] = None
+                elif isinstance(json_value, dict):
+                    raw_message.update(json_value)
                 else:
-                    raw_message = {
-                        **raw_message,
-                        **json_value,
-                    }
+                    raise TypeError("sync item value is not an object")
             except (json.JSONDecodeError, TypeError):
                 raw_message["value"] = part.value
             message = MessageSyncMessage.deserialize(raw_message)
             evt = MessageSyncEvent(iris=parsed_item, message=message)
         elif part.path.startswith("/direct_v2/inbox/threads/"):
+            # The value can be an entire thread, so add the extra keys to it instead of copying
+            # it into a new dict. setdefault keeps the value's own keys taking precedence.
+            data = json_loads(part.value)
+            data.setdefault("path", part.path)
+            data.setdefault("op", part.op)
             if part.op == Operation.REMOVE:
                 blank, direct_v2, inbox, threads, thread_id, *_ = part.path.split("/")
-                evt = ThreadRemoveEvent.deserialize(
-                    {
-                        "thread_id": thread_id,
-                        "path": part.path,
-                        "op": part.op,
-                        **json.loads(part.value),
-                    }
-                )
+                data.setdefault("thread_id", thread_id)
+                evt = ThreadRemoveEvent.deserialize(data)
             else:
-                evt = ThreadSyncEvent.deserialize(
-                    {
-                        "path": part.path,
-                        "op": part.op,
-                        **json.loads(part.value),
-                    }
-                )
+                evt = ThreadSyncEvent.deserialize(data)
         else:
             self.log.warning(f"Unsupported path {part.path}")
             return False
         self._outgoing_events.put_nowait(evt)
         return True
 
-    def _on_message_sync(self, payload: bytes) -> None:
-        parsed = json.loads(payload.decode("utf-8"))
+    def _on_message_sync(self, message: pmc.MQTTMessage) -> None:
+        parsed = json_loads(message.payload)
         self.log.trace("Got message sync event: %s", parsed)
         has_items = False
+        seq_id_changed = False
         for sync_item in parsed:
             parsed_item = IrisPayload.deserialize(sync_item)
             if self._iris_seq_id < parsed_item.seq_id:
-                self.log.trace(f"Got new seq_id: {parsed_item.seq_id}")
+                self.log.trace("Got new seq_id: %s", parsed_item.seq_id)
                 self._iris_seq_id = parsed_item.seq_id
-                self._iris_snapshot_at_ms = int(time.time() * 1000)
-                background_task.create(
-                    self._dispatch(NewSequenceID(self._iris_seq_id, self._iris_snapshot_at_ms))
-                )
+                self._iris_snapshot_at_ms = time.time_ns() // 1_000_000
+                seq_id_changed = True
             for part in parsed_item.data:
                 has_items = self._on_messager_sync_item(part, parsed_item) or has_items
-        if has_items and not self._event_dispatcher_task:
-            self._event_dispatcher_task = asyncio.create_task(self._dispatcher_loop())
-
-    def _on_pubsub(self, payload: bytes) -> None:
-        parsed_thrift = IncomingMessage.from_thrift(payload)
-        self.log.trace(f"Got pubsub event {parsed_thrift.topic} / {parsed_thrift.payload}")
-        message = PubsubPayload.parse_json(parsed_thrift.payload)
-        for data in message.data:
+        if seq_id_changed:
+            # Only one update per batch, queued after the items so that the new sequence ID
+            # doesn't get saved before the events it covers have been handled.
+            self._queue_event(NewSequenceID(self._iris_seq_id, self._iris_snapshot_at_ms))
+        elif has_items:
+            self._start_dispatcher()
+
+    def _on_pubsub(self, message: pmc.MQTTMessage) -> None:
+        parsed_thrift = IncomingMessage.from_thrift(message.payload)
+        self.log.trace("Got pubsub event %s / %s", parsed_thrift.topic, parsed_thrift.payload)
+        pubsub = PubsubPayload.deserialize(json_loads(parsed_thrift.payload))
+        for data in pubsub.data:
             match = ACTIVITY_INDICATOR_REGEX.match(data.path)
             if match:
                 evt = PubsubEvent(
                     data=data,
-                    base=message,
+                    base=pubsub,
                     thread_id=match.group(1),
                     activity_indicator_id=match.group(2),
                 )
-                self._loop.create_task(self._dispatch(evt))
+                self._queue_event(evt)
             elif not data.double_publish:
                 self.log.debug("Pubsub: no activity indicator on data: %s", data)
             else:
                 self.log.debug("Pubsub: double publish: %s", data.path)
 
     def _parse_realtime_sub_item(self, topic: str | GraphQLQueryID, raw: dict) -> Iterable[Any]:
-        if topic == GraphQLQueryID.APP_PRESENCE:
-            yield AppPresenceEventPayload.deserialize(raw).presence_event
-        elif topic == GraphQLQueryID.ZERO_PROVISION:
-            yield RealtimeZeroProvisionPayload.deserialize(raw).zero_product_provisioning_event
-        elif topic == GraphQLQueryID.CLIENT_CONFIG_UPDATE:
-            yield ClientConfigUpdatePayload.deserialize(raw).client_config_update_event
-        elif topic == GraphQLQueryID.LIVE_REALTIME_COMMENTS:
-            yield LiveVideoCommentPayload.deserialize(raw).live_video_comment_event
-        elif topic == "direct":
+        if topic == "direct":
             event = raw["event"]
             for item in raw["data"]:
-                yield RealtimeDirectEvent.deserialize(
-                    {
-                        "event": event,
-                        **self._parse_direct_thread_path(item["path"]),
-                        **item,
-                    }
-                )
+                data = self._parse_direct_thread_path(item["path"])
+                data["event"] = event
+                data.update(item)
+                yield RealtimeDirectEvent.deserialize(data)
+        else:
+            yield REALTIME_SUB_PARSERS[topic](raw)
 
-    def _on_realtime_sub(self, payload: bytes) -> None:
-        parsed_thrift = IncomingMessage.from_thrift(payload)
-        try:
-            topic = GraphQLQueryID(parsed_thrift.topic)
-        except ValueError:
-            topic = parsed_thrift.topic
-        self.log.trace(f"Got realtime sub event {topic} / {parsed_thrift.payload}")
-        allowed = (
-            "direct",
-            GraphQLQueryID.APP_PRESENCE,
-            GraphQLQueryID.ZERO_PROVISION,
-            GraphQLQueryID.CLIENT_CONFIG_UPDATE,
-            GraphQLQueryID.LIVE_REALTIME_COMMENTS,
-        )
-        if topic not in allowed:
+    def _on_realtime_sub(self, message: pmc.MQTTMessage) -> None:
+        parsed_thrift = IncomingMessage.from_thrift(message.payload)
+        topic = GRAPHQL_QUERY_IDS.get(parsed_thrift.topic, parsed_thrift.topic)
+        self.log.trace("Got realtime sub event %s / %s", topic, parsed_thrift.payload)
+        if topic != "direct" and topic not in REALTIME_SUB_PARSERS:
             return
-        parsed_json = json.loads(parsed_thrift.payload)
+        parsed_json = json_loads(parsed_thrift.payload)
         for evt in self._parse_realtime_sub_item(topic, parsed_json):
-            self._loop.create_task(self._dispatch(evt))
+            self._queue_event(evt)
 
     def _handle_send_response(self, message: pmc.MQTTMessage) -> None:
-        data = json.loads(message.payload.decode("utf-8"))
+        data = json_loads(message.payload)
         try:
             ccid = data["payload"]["client_context"]
         except KeyError:
             self.log.warning(
                 "Didn't find client_context in send message response: %s", message.payload
             )
-            ccid = self._message_response_waiter_id
-        else:
-            if ccid != self._message_response_waiter_id:
-                self.log.error(
-                    "Mismatching client_context in send message response (%s != %s)",
-                    ccid,
-                    self._message_response_waiter_id,
-                )
-                return
-        if self._message_response_waiter and not self._message_response_waiter.done():
+            # Commands are answered in the order they were sent, so match the response to the
+            # oldest command in flight (the first key, as dicts keep insertion order).
+            ccid = next(iter(self._message_response_waiters), None)
+        waiter = self._message_response_waiters.pop(ccid, None)
+        if waiter and not waiter.done():
             self.log.debug("Got response to %s: %s", ccid, message.payload)
-            self._message_response_waiter.set_result(message)
-            self._message_response_waiter = None
-            self._message_response_waiter_id = None
+            waiter.set_result(message)
         else:
             self.log.warning("Didn't find task waiting for response %s", message.payload)
 
@@ -494,41 +536,39 @@ class AndroidMQTT:
         try:
             topic = RealtimeTopic.decode(message.topic)
             # Instagram Android MQTT messages are always compressed
-            message.payload = zlib.decompress(message.payload)
-            if topic == RealtimeTopic.MESSAGE_SYNC:
-                self._on_message_sync(message.payload)
-            elif topic == RealtimeTopic.PUBSUB:
-                self._on_pubsub(message.payload)
-            elif topic == RealtimeTopic.REALTIME_SUB:
-                self._on_realtime_sub(message.payload)
-            elif topic == RealtimeTopic.SEND_MESSAGE_RESPONSE:
-                self._handle_send_response(message)
-            elif topic == RealtimeTopic.UNKNOWN_PP:
-                self.log.warning("Reconnecting after receiving /pp message")
-                background_task.create(self._reconnect())
+            message.payload = zlib_decompress(message.payload)
+            try:
+                handler = self._topic_handlers[topic]
+            except KeyError:
+                self._on_response(topic, message)
             else:
-                try:
-                    waiter = self._response_waiters.pop(topic)
-                except KeyError:
-                    self.log.debug(
-                        "No handler for MQTT message in %s: %s", topic.value, message.payload
-                    )
-                else:
-                    if not waiter.done():
-                        waiter.set_result(message)
-                        self.log.trace("Got response %s: %s", topic.value, message.payload)
-                    else:
-                        self.log.debug(
-                            "Got response in %s, but waiter was already cancelled: %s",
-                            topic,
-                            message.payload,
-                        )
+                handler(message)
         except Exception:
             self.log.exception("Error in incoming MQTT message handler")
             self.log.trace("Errored MQTT payload: %s", message.payload)
         finally:
             self.maybe_reset_keepalive()
 
+    def _on_unknown_pp(self, message: pmc.MQTTMessage) -> None:
+        self.log.warning("Reconnecting after receiving /pp message")
+        background_task.create(self._reconnect())
+
+    def _on_response(self, topic: RealtimeTopic, message: pmc.MQTTMessage) -> None:
+        try:
+            waiter = self._response_waiters.pop(topic)
+        except KeyError:
+            self.log.debug("No handler for MQTT message in %s: %s", topic.value, message.payload)
+        else:
+            if not waiter.done():
+                waiter.set_result(message)
+                self.log.trace("Got response %s: %s", topic.value, message.payload)
+            else:
+                self.log.debug(
+                    "Got response in %s, but waiter was already cancelled: %s",
+                    topic,
+                    message.payload,
+                )
+
     # endregion
 
     async def _reconnect(self) -> None:
@@ -542,10 +582,10 @@ class AndroidMQTT:
     def add_event_handler(
         self, evt_type: Type[T], handler: Callable[[T], Awaitable[None]]
     ) -> None:
-        self._event_handlers[evt_type].append(handler)
+        self._event_handlers.setdefault(evt_type, []).append(handler)
 
     async def _dispatch(self, evt: T) -> None:
-        for handler in self._event_handlers[type(evt)]:
+        for handler in self._event_handlers.get(type(evt), ()):
             try:
                 await handler(evt)
             except Exception:
@@ -553,17 +593,52 @@ class AndroidMQTT:
 
     def disconnect(self) -> None:
         self._client.disconnect()
+        self._misc_loop_wakeup.set()
+
+    def _next_loop_misc_delay(self) -> float | None:
+        # Beware, internal API: these are the timestamps loop_misc() uses for keepalive checks.
+        # Nothing needs to happen before the next ping (or the ping timeout) is due, except for
+        # disconnections and keepalive changes, which set _misc_loop_wakeup.
+        client = self._client
+        if not client._keepalive:
+            return None
+        if client._ping_t > 0:
+            last_activity = client._ping_t
+        else:
+            last_activity = min(client._last_msg_in, client._last_msg_out)
+        # asyncio may wake up slightly early, so don't let that turn into a busy loop
+        return max(last_activity + client._keepalive - pmc.time_func(), 0.1)
+
+    def _start_dispatcher(self) -> None:
+        if not self._event_dispatcher_task:
+            self._event_dispatcher_task = asyncio.create_task(self._dispatcher_loop())
+
+    def _queue_event(self, evt: Any) -> None:
+        self._outgoing_events.put_nowait(evt)
+        self._start_dispatcher()
+
+    async def _dispatch_all(self, events: list[Any]) -> None:
+        for evt in events:
+            await self._dispatch(evt)
 
     async def _dispatcher_loop(self) -> None:
         loop_id = f"{hex(id(self))}#{time.monotonic()}"
         self.log.debug(f"Dispatcher loop {loop_id} starting")
+        batch: asyncio.Task | None = None
         try:
             while True:
-                evt = await self._outgoing_events.get()
-                await asyncio.shield(self._dispatch(evt))
+                events = [await self._outgoing_events.get()]
+                # Take everything that's already queued, so a burst only needs one shielded task
+                while not self._outgoing_events.empty():
+                    events.append(self._outgoing_events.get_nowait())
+                batch = asyncio.create_task(self._dispatch_all(events))
+                await asyncio.shield(batch)
         except asyncio.CancelledError:
             tasks = self._outgoing_events
             self._outgoing_events = asyncio.Queue()
+            if batch and not batch.done():
+                # Finish the current batch first so that events stay in order
+                await batch
             if not tasks.empty():
                 self.log.debug(
                     f"Dispatcher loop {loop_id} stopping after dispatching {tasks.qsize()} events"
@@ -593,8 +668,13 @@ class AndroidMQTT:
             await self._reconnect()
 
             while True:
+                self._misc_loop_wakeup.clear()
                 try:
-                    await asyncio.sleep(1)
+                    await asyncio.wait_for(
+                        self._misc_loop_wakeup.wait(), timeout=self._next_loop_misc_delay()
+                    )
+                except asyncio.TimeoutError:
+                    pass
                 except asyncio.CancelledError:
                     self.disconnect()
                     # this might not be necessary
@@ -655,15 +735,26 @@ class AndroidMQTT:
 
     # region Basic outgoing MQTT
 
-    @staticmethod
-    def _publish_cancel_later(fut: asyncio.Future) -> None:
+    # Timed out waiters are removed too, otherwise a PUBACK or response that never arrives would
+    # leave them around forever and keep maybe_reset_keepalive() from resetting the keepalive.
+    def _publish_cancel_later(self, mid: int, fut: asyncio.Future) -> None:
+        if self._publish_waiters.get(mid) is fut:
+            del self._publish_waiters[mid]
         if not fut.done():
             fut.set_exception(asyncio.TimeoutError("MQTT publish timed out"))
+        self.maybe_reset_keepalive()
 
-    @staticmethod
-    def _request_cancel_later(fut: asyncio.Future) -> None:
+    def _request_cancel_later(self, response: RealtimeTopic, fut: asyncio.Future) -> None:
+        if self._response_waiters.get(response) is fut:
+            del self._response_waiters[response]
         if not fut.done():
             fut.set_exception(asyncio.TimeoutError("MQTT request timed out"))
+        self.maybe_reset_keepalive()
+
+    def _command_cancel_later(self, client_context: str, fut: asyncio.Future) -> None:
+        if not fut.done():
+            self.log.error("Request with ID %s timed out!", client_context)
+            fut.set_exception(asyncio.TimeoutError("MQTT command timed out"))
 
     # The following two functions mutate the client keepalive (cheeky) to temporarily increase
     # ping attempts during read/write to MQTT. If things are flowing this should change nothing,
@@ -671,28 +762,32 @@ class AndroidMQTT:
     # connection much quicker than the default keepalive.
     def set_request_keepalive(self):
         self._client._keepalive = REQUEST_KEEPALIVE
+        self._misc_loop_wakeup.set()
 
     def maybe_reset_keepalive(self):
         # Reset the keepalive back to the default value if we have no pending publish/receive
         if (
             not self._response_waiters
             and not self._publish_waiters
-            and not self._message_response_waiter
+            and not self._message_response_waiters
         ):
             self._client._keepalive = self._default_keepalive
 
     def publish(self, topic: RealtimeTopic, payload: str | bytes | dict) -> asyncio.Future:
         if isinstance(payload, dict):
-            payload = json.dumps(payload)
+            payload = json_dumps(payload)
         if isinstance(payload, str):
             payload = payload.encode("utf-8")
-        self.log.trace(f"Publishing message in {topic.value} ({topic.encoded}): {payload}")
-        payload = zlib.compress(payload, level=9)
+        encoded_topic = topic.encoded
+        self.log.trace("Publishing message in %s (%s): %s", topic.value, encoded_topic, payload)
+        payload = zlib_compress(payload)
         self.set_request_keepalive()
-        info = self._client.publish(topic.encoded, payload, qos=1)
-        self.log.trace(f"Published message ID: {info.mid}")
+        info = self._client.publish(encoded_topic, payload, qos=1)
+        self.log.trace("Published message ID: %s", info.mid)
         fut = self._loop.create_future()
-        timeout_handle = self._loop.call_later(REQUEST_TIMEOUT, self._publish_cancel_later, fut)
+        timeout_handle = self._loop.call_later(
+            REQUEST_TIMEOUT, self._publish_cancel_later, info.mid, fut
+        )
         fut.add_done_callback(lambda _: timeout_handle.cancel())
         self._publish_waiters[info.mid] = fut
         return fut
@@ -709,10 +804,10 @@ class AndroidMQTT:
             self._response_waiters[response] = fut
             background_task.create(self.publish(topic, payload))
             self.log.trace(
-                f"Request publish to {topic.value} queued, waiting for response {response.name}"
+                "Request publish to %s queued, waiting for response %s", topic.value, response.name
             )
             timeout_handle = self._loop.call_later(
-                timeout or REQUEST_TIMEOUT, self._request_cancel_later, fut
+                timeout or REQUEST_TIMEOUT, self._request_cancel_later, response, fut
             )
             fut.add_done_callback(lambda _: timeout_handle.cancel())
             return await fut
@@ -732,14 +827,16 @@ class AndroidMQTT:
             timeout=20,
         )
         self.log.debug("Iris subscribe response: %s", resp.payload.decode("utf-8"))
-        resp_dict = json.loads(resp.payload.decode("utf-8"))
+        resp_dict = json_loads(resp.payload)
         if resp_dict["error_type"] and resp_dict["error_message"]:
             raise IrisSubscribeError(resp_dict["error_type"], resp_dict["error_message"])
         latest_seq_id = resp_dict.get("latest_seq_id")
         if latest_seq_id > self._iris_seq_id:
             self.log.info(f"Latest sequence ID is {latest_seq_id}, catching up from {seq_id}")
             self._iris_seq_id = latest_seq_id
-            self._iris_snapshot_at_ms = resp_dict.get("subscribed_at_ms", int(time.time() * 1000))
+            self._iris_snapshot_at_ms = resp_dict.get(
+                "subscribed_at_ms", time.time_ns() // 1_000_000
+            )
             background_task.create(
                 self._dispatch(NewSequenceID(self._iris_seq_id, self._iris_snapshot_at_ms))
             )
@@ -765,11 +862,10 @@ class AndroidMQTT:
 
     async def send_foreground_state(self, state: ForegroundStateConfig) -> None:
         self.log.debug("Updating foreground state: %s", state)
-        await self.publish(
-            RealtimeTopic.FOREGROUND_STATE, zlib.compress(state.to_thrift(), level=9)
-        )
+        await self.publish(RealtimeTopic.FOREGROUND_STATE, zlib_compress(state.to_thrift()))
         if state.keep_alive_timeout:
             self._client._keepalive = state.keep_alive_timeout
+            self._misc_loop_wakeup.set()
 
     async def send_command(
         self,
@@ -778,7 +874,7 @@ class AndroidMQTT:
         client_context: str | None = None,
         **kwargs: Any,
     ) -> CommandResponse | None:
-        self.log.debug(f"Preparing to send {action} to {thread_id} with {client_context}")
+        self.log.debug("Preparing to send %s to %s with %s", action, thread_id, client_context)
         client_context = client_context or self.state.gen_client_context()
         req = {
             "thread_id": thread_id,
@@ -788,24 +884,25 @@ class AndroidMQTT:
             # "device_id": self.state.cookies["ig_did"],
             **kwargs,
         }
-        lock_start = time.monotonic()
-        async with self._message_response_waiter_lock:
-            lock_wait_dur = time.monotonic() - lock_start
-            if lock_wait_dur > 1:
-                self.log.warning(f"Waited {lock_wait_dur:.3f} seconds to send {client_context}")
-            fut = self._message_response_waiter = asyncio.Future()
-            self._message_response_waiter_id = client_context
-            background_task.create(self.publish(RealtimeTopic.SEND_MESSAGE, req))
-            self.log.debug(
-                f"Request publish to {RealtimeTopic.SEND_MESSAGE} queued, "
-                f"waiting for response {RealtimeTopic.SEND_MESSAGE_RESPONSE}"
-            )
-            try:
-                resp = await asyncio.wait_for(fut, timeout=REQUEST_TIMEOUT)
-            except asyncio.TimeoutError:
-                self.log.error(f"Request with ID {client_context} timed out!")
-                raise
-            return CommandResponse.parse_json(resp.payload.decode("utf-8"))
+        # Responses are routed by client_context, so multiple commands can be in flight at once.
+        fut = self._message_response_waiters[client_context] = asyncio.Future()
+        background_task.create(self.publish(RealtimeTopic.SEND_MESSAGE, req))
+        self.log.debug(
+            "Request publish to %s queued, waiting for response %s",
+            RealtimeTopic.SEND_MESSAGE,
+            RealtimeTopic.SEND_MESSAGE_RESPONSE,
+        )
+        timeout_handle = self._loop.call_later(
+            REQUEST_TIMEOUT, self._command_cancel_later, client_context, fut
+        )
+        fut.add_done_callback(lambda _: timeout_handle.cancel())
+        try:
+            resp = await fut
+        finally:
+            if self._message_response_waiters.get(client_context) is fut:
+                del self._message_response_waiters[client_context]
+            self.maybe_reset_keepalive()
+        return CommandResponse.deserialize(json_loads(resp.payload))
 
     def send_item(
         self,
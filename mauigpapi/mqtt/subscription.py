@@ -54,6 +54,11 @@ class GraphQLQueryID(Enum):
     BUSINESS_DELIVERY = "17940467278199720"
 
 
+GRAPHQL_QUERY_IDS: dict[str, GraphQLQueryID] = {
+    query_id.value: query_id for query_id in GraphQLQueryID
+}
+
+
 everclear_subscriptions = {
     "inapp_notification_subscribe_comment": GraphQLQueryID.INAPP_NOTIFICATION.value,
     "inapp_notification_subscribe_comment_mention_and_reply": GraphQLQueryID.INAPP_NOTIFICATION.value,
@@ -346,8 +351,6 @@ _topic_map: dict[str, str] = {
     "/t_rtc_log": "274",
 }
 
-_reverse_topic_map: dict[str, str] = {value: key for key, value in _topic_map.items()}
-
 
 class RealtimeTopic(Enum):
     SUB_IRIS = "/ig_sub_iris"
@@ -367,10 +370,16 @@ class RealtimeTopic(Enum):
     RS_RESP = "/rs_resp"
     T_RTC_LOG = "/t_rtc_log"
 
-    @property
-    def encoded(self) -> str:
-        return _topic_map[self.value]
+    # Set for each member below the class, so encoding a topic is a plain attribute load
+    encoded: str
 
     @staticmethod
     def decode(val: str) -> RealtimeTopic:
-        return RealtimeTopic(_reverse_topic_map[val])
+        return _reverse_topic_map[val]
+
+
+for _topic in RealtimeTopic:
+    _topic.encoded = _topic_map[_topic.value]
+del _topic
+
+_reverse_topic_map: dict[str, RealtimeTopic] = {topic.encoded: topic for topic in RealtimeTopic}
@@ -83,4 +83,4 @@ class AndroidState(SerializableAttrs):
 
     @staticmethod
     def gen_client_context() -> str:
-        return str((int(time.time() * 1000) << 22) + random.randint(10000, 5000000))
+        return str(((time.time_ns() // 1_000_000) << 22) + random.randint(10000, 5000000))
@@ -25,6 +25,39 @@ from .account import BaseResponseUser
 from .thread import Thread
 from .thread_item import ThreadItem
 
+__all__ = (
+    "Operation",
+    "ThreadAction",
+    "ReactionStatus",
+    "TypingStatus",
+    "CommandResponsePayload",
+    "CommandResponse",
+    "IrisPayloadData",
+    "IrisPayload",
+    "MessageSyncMessage",
+    "MessageSyncEvent",
+    "ThreadSyncEvent",
+    "ThreadRemoveEvent",
+    "PubsubPublishMetadata",
+    "PubsubBasePayload",
+    "ActivityIndicatorData",
+    "PubsubPayloadData",
+    "PubsubPayload",
+    "PubsubEvent",
+    "AppPresenceEvent",
+    "AppPresenceEventPayload",
+    "ZeroProductProvisioningEvent",
+    "RealtimeZeroProvisionPayload",
+    "ClientConfigUpdateEvent",
+    "ClientConfigUpdatePayload",
+    "RealtimeDirectData",
+    "RealtimeDirectEvent",
+    "LiveVideoSystemComment",
+    "LiveVideoComment",
+    "LiveVideoCommentEvent",
+    "LiveVideoCommentPayload",
+)
+
 
 class Operation(SerializableEnum):
     ADD = "add"
@@ -793,7 +793,7 @@ class User(DBUser, BaseUser):
 
     async def _sync_threads_with_delay(
         self,
-        threads: AsyncIterable[Thread],
+        threads: AsyncGenerator[Thread, None],
         increment_total_backfilled_portals: bool = False,
         stop_when_threads_have_no_messages_to_backfill: bool = False,
         local_limit: int | None = None,
@@ -801,23 +801,28 @@ class User(DBUser, BaseUser):
         sync_delay = self.config["bridge.backfill.min_sync_thread_delay"]
         last_thread_sync_ts = 0.0
         found_thread_count = 0
-        async for thread in threads:
-            found_thread_count += 1
-            now = time.monotonic()
-            if now < last_thread_sync_ts + sync_delay:
-                delay = last_thread_sync_ts + sync_delay - now
-                self.log.debug("Thread sync is happening too quickly. Waiting for %ds", delay)
-                await asyncio.sleep(delay)
-
-            last_thread_sync_ts = time.monotonic()
-            had_new_messages = await self._sync_thread(thread)
-            if not had_new_messages and stop_when_threads_have_no_messages_to_backfill:
-                self.log.debug("Got to threads with no new messages. Stopping sync.")
-                return
+        try:
+            async for thread in threads:
+                found_thread_count += 1
+                now = time.monotonic()
+                if now < last_thread_sync_ts + sync_delay:
+                    delay = last_thread_sync_ts + sync_delay - now
+                    self.log.debug("Thread sync is happening too quickly. Waiting for %ds", delay)
+                    await asyncio.sleep(delay)
+
+                last_thread_sync_ts = time.monotonic()
+                had_new_messages = await self._sync_thread(thread)
+                if not had_new_messages and stop_when_threads_have_no_messages_to_backfill:
+                    self.log.debug("Got to threads with no new messages. Stopping sync.")
+                    return
 
-            if increment_total_backfilled_portals:
-                self.total_backfilled_portals = (self.total_backfilled_portals or 0) + 1
-            await self.update()
+                if increment_total_backfilled_portals:
+                    self.total_backfilled_portals = (self.total_backfilled_portals or 0) + 1
+                await self.update()
+        finally:
+            # Stop the iterator right away if the sync stops early, instead of leaving any
+            # prefetched inbox page running until the generator is garbage collected.
+            await threads.aclose()
         if local_limit is None or found_thread_count < local_limit:
             if local_limit is None:
                 self.log.info(